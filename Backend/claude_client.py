@@ -4,13 +4,55 @@ Handles all AI-powered operations: summarization, rights detection, and translat
 """
 
 import os
+import time
 from anthropic import Anthropic
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 import json
 
+from model_router import ModelRouter
+from single_flight import SingleFlight, coalesce, text_key
+from structured_output import (
+    SEGMENT_TOOL, SIMPLIFY_TOOL, RIGHTS_TOOL, BATCH_SIMPLIFY_TOOL, BATCH_TRANSLATE_TOOL,
+    IncrementalJSONParser, fill_missing, tool_definition, validate
+)
+
+# How many times a truncated list reply is resumed before giving up
+MAX_CONTINUATIONS = 2
+
+# Output-token cap for one multi-item request
+BATCH_MAX_TOKENS = 4096
+
+# readability_note of the fallback simplify_text returns when Claude fails
+SIMPLIFY_FAILED_NOTE = "Processing failed"
+
+class InvalidOutputError(ValueError):
+    """
+    A reply that arrived but failed validation; carries the API message for usage accounting
+    and, when the reply was cut short, whatever usable part of it arrived
+    """
+    def __init__(self, reason: str, message=None, partial=None):
+        super().__init__(reason)
+        self.message = message
+        self.partial = partial
+
 class ClaudeClient:
-    def __init__(self, api_key: Optional[str] = None):
-        """Initialize Claude client with API key"""
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        shared_store=None,
+        requests_per_minute: Optional[int] = None,
+        router: Optional[ModelRouter] = None,
+        on_route: Optional[Callable[[Dict], None]] = None,
+        coalesce_timeout: Optional[float] = None
+    ):
+        """
+        Initialize Claude client with API key
+        When a shared_store is given and requests_per_minute (or ANTHROPIC_REQUESTS_PER_MINUTE)
+        is set, every API call draws from a budget shared by all worker processes.
+        on_route receives one record per routed call, naming its operation under routed_operation
+        so routing records are not counted alongside the operations themselves.
+        Identical concurrent calls are coalesced; followers wait up to coalesce_timeout seconds.
+        """
         self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
         if not self.api_key:
             raise ValueError("ANTHROPIC_API_KEY not found in environment variables")
@@ -19,15 +61,229 @@ class ClaudeClient:
         # Using Claude 3 Haiku - fast and available for this API key
         # Note: Can upgrade to claude-3-5-sonnet-20241022 with full API access
         self.model = "claude-3-haiku-20240307"
+        self.shared_store = shared_store
+        requests_per_minute = requests_per_minute or os.getenv("ANTHROPIC_REQUESTS_PER_MINUTE")
+        self.requests_per_minute = int(requests_per_minute) if requests_per_minute else None
+        self.rate_max_wait = float(os.getenv("ANTHROPIC_RATE_MAX_WAIT", "30"))
+        self.router = router or ModelRouter(fast_model=self.model)
+        self.on_route = on_route
+        self.single_flight = SingleFlight(
+            timeout=coalesce_timeout or float(os.getenv("COALESCE_TIMEOUT", "180"))
+        )
+    
+    def _wait_for_budget(self) -> None:
+        """Take one request from the shared rate budget; raises TimeoutError if it stays exhausted"""
+        if self.shared_store is not None and self.requests_per_minute:
+            self.shared_store.acquire("anthropic_requests", self.requests_per_minute, max_wait=self.rate_max_wait)
+    
+    def _create_message(self, prompt: str, max_tokens: int, model: Optional[str] = None):
+        """Send a single-turn prompt, waiting on the shared rate budget if configured"""
+        self._wait_for_budget()
+        return self.client.messages.create(
+            model=model or self.model,
+            max_tokens=max_tokens,
+            messages=[{"role": "user", "content": prompt}]
+        )
+    
+    def _record_route(self, route: Dict, input_length: int, latency_ms: float, message=None, error: Optional[str] = None) -> None:
+        """Report one routing decision and its cost to the on_route hook"""
+        if self.on_route is None:
+            return
+        usage = getattr(message, "usage", None)
+        record = {
+            "routed_operation": route["operation"],
+            "tier": route["tier"],
+            "model": route["model"],
+            "max_tokens": route["max_tokens"],
+            "reason": route["reason"],
+            "complexity_score": route["complexity"]["score"],
+            "input_length": input_length,
+            "latency_ms": round(latency_ms, 2),
+            "input_tokens": getattr(usage, "input_tokens", None),
+            "output_tokens": getattr(usage, "output_tokens", None),
+            "success": error is None
+        }
+        if error is not None:
+            record["error"] = error
+        try:
+            self.on_route(record)
+        except Exception as e:
+            print(f"Error recording route: {e}")
+    
+    def _stream_tool_call(self, prompt: str, tool: Dict, route: Dict, parser: IncrementalJSONParser):
+        """Stream a forced tool call, feeding the tool input JSON to the parser as it arrives"""
+        self._wait_for_budget()
+        with self.client.messages.stream(
+            model=route["model"],
+            max_tokens=route["max_tokens"],
+            messages=[{"role": "user", "content": prompt}],
+            tools=[tool_definition(tool)],
+            tool_choice={"type": "tool", "name": tool["name"]}
+        ) as stream:
+            for event in stream:
+                if event.type == "content_block_delta" and event.delta.type == "input_json_delta":
+                    parser.feed(event.delta.partial_json)
+            return stream.get_final_message()
+    
+    def _routed_call(self, operation: str, text: str, attempt: Callable[[Dict], tuple], route: Optional[Dict] = None):
+        """
+        Run attempt(route) on the route chosen for this input
+        An attempt that raises InvalidOutputError is retried once on the stronger tier;
+        if that retry fails outright, the first tier's error is raised so callers take their usual fallback
+        """
+        route = route or self.router.route(operation, text)
+        last_error = None
+        while route is not None:
+            start = time.perf_counter()
+            try:
+                result, message = attempt(route)
+            except InvalidOutputError as e:
+                self._record_route(route, len(text), (time.perf_counter() - start) * 1000, e.message, str(e))
+                last_error = e
+                route = self.router.escalate(route)
+                continue
+            except Exception as e:
+                if last_error is None:
+                    raise
+                self._record_route(route, len(text), (time.perf_counter() - start) * 1000, error=str(e))
+                break
+            self._record_route(route, len(text), (time.perf_counter() - start) * 1000, message)
+            return result
+        raise last_error
+    
+    def _structured_call(
+        self,
+        operation: str,
+        text: str,
+        prompt: str,
+        tool: Dict,
+        route: Optional[Dict] = None,
+        on_item: Optional[Callable[[Dict], None]] = None
+    ) -> Dict:
+        """
+        Get a schema-checked tool result for the prompt
+        Completed list items go to on_item while the reply streams; an item is
+        never forwarded twice, even if the call is retried on another tier
+        """
+        emitted = 0
+        
+        def attempt(route: Dict):
+            nonlocal emitted
+            seen = 0
+            
+            def forward(item: Dict) -> None:
+                nonlocal seen, emitted
+                seen += 1
+                if on_item is not None and seen > emitted:
+                    emitted = seen
+                    on_item(item)
+            
+            parser = IncrementalJSONParser(tool.get("stream_key"), forward)
+            message = self._stream_tool_call(prompt, tool, route, parser)
+            try:
+                if message.stop_reason == "max_tokens":
+                    result = self._resume_truncated(text, prompt, tool, route, parser, forward)
+                else:
+                    result = parser.value()
+                validate(result, tool["input_schema"])
+            except ValueError as e:
+                raise InvalidOutputError(str(e), message)
+            return result, message
+        
+        return self._routed_call(operation, text, attempt, route)
+    
+    def _resume_truncated(
+        self,
+        text: str,
+        prompt: str,
+        tool: Dict,
+        route: Dict,
+        parser: IncrementalJSONParser,
+        on_item: Callable[[Dict], None]
+    ) -> Dict:
+        """
+        Salvage a reply cut off at max_tokens
+        Object replies keep the fields that arrived and ask only for the missing ones;
+        list replies keep their completed items and ask only for the items after them
+        """
+        schema = tool["input_schema"]
+        key = tool.get("stream_key")
+        if key is None:
+            return self._resume_fields(text, prompt, tool, route, parser.complete_fields())
+        partial = parser.repair()
+        
+        items = list(parser.items)
+        label = schema["properties"][key]["items"]["required"][0]
+        for _ in range(MAX_CONTINUATIONS):
+            continuation = f"""{prompt}
+
+Your previous answer was cut off. These {key} were already recorded, in order:
+{json.dumps([item.get(label) for item in items])}
+Record only the {key} that come after them, in document order."""
+            resume_route = {**route, "reason": "resumed truncated output"}
+            continuation_parser = IncrementalJSONParser(key, on_item)
+            start = time.perf_counter()
+            message = self._stream_tool_call(continuation, tool, resume_route, continuation_parser)
+            self._record_route(resume_route, len(text), (time.perf_counter() - start) * 1000, message)
+            items.extend(continuation_parser.items)
+            if message.stop_reason != "max_tokens" or not continuation_parser.items:
+                break
+        return fill_missing({**partial, key: items}, schema, [key])
+    
+    def _resume_fields(self, text: str, prompt: str, tool: Dict, route: Dict, partial: Dict) -> Dict:
+        """
+        Re-request the fields a truncated object reply never reached
+        Fields still missing after MAX_CONTINUATIONS get empty defaults and are listed under incomplete_fields
+        """
+        schema = tool["input_schema"]
+        result = dict(partial)
+        for _ in range(MAX_CONTINUATIONS):
+            missing = [field for field in schema.get("required", []) if field not in result]
+            if not missing:
+                break
+            missing_tool = {
+                **tool,
+                "input_schema": {
+                    "type": "object",
+                    "properties": {field: schema["properties"][field] for field in missing},
+                    "required": missing
+                }
+            }
+            continuation = f"""{prompt}
+
+Your previous answer was cut off. These fields were already recorded:
+{json.dumps(result)}
+Record only the missing fields: {", ".join(missing)}."""
+            resume_route = {**route, "reason": "resumed truncated output"}
+            continuation_parser = IncrementalJSONParser()
+            start = time.perf_counter()
+            message = self._stream_tool_call(continuation, missing_tool, resume_route, continuation_parser)
+            self._record_route(resume_route, len(text), (time.perf_counter() - start) * 1000, message)
+            try:
+                received = continuation_parser.value() if message.stop_reason != "max_tokens" else continuation_parser.complete_fields()
+            except ValueError:
+                break
+            # Only take fields that were asked for, so the continuation cannot rewrite what already arrived
+            result.update({field: value for field, value in received.items() if field in missing})
+
+        incomplete = [field for field in schema.get("required", []) if field not in result]
+        result = fill_missing(result, schema, tool.get("essential", []))
+        if incomplete:
+            result["incomplete_fields"] = incomplete
+        return result
+    
+    @staticmethod
+    def _parse_translation(response_text: str) -> str:
+        """Validate that a translation came back"""
+        translation = response_text.strip()
+        if not translation:
+            raise ValueError("Empty translation")
+        return translation
         
     def test_api_connection(self) -> Dict:
         """Test API connection and return available model info"""
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=100,
-                messages=[{"role": "user", "content": "Hello"}]
-            )
+            response = self._create_message("Hello", max_tokens=100)
             return {
                 "success": True,
                 "model": self.model,
@@ -40,17 +296,20 @@ class ClaudeClient:
                 "api_key_prefix": self.api_key[:20] + "..." if self.api_key else "None"
             }
     
-    def segment_document(self, text: str) -> Dict:
+    @coalesce(lambda text, on_section=None: text_key(text[:8000]))
+    def segment_document(self, text: str, on_section: Optional[Callable[[Dict], None]] = None) -> Dict:
         """
         Use Claude to intelligently segment document into sections
-        Returns structured JSON with sections
+        Returns structured JSON with sections; on_section is called with each
+        section as soon as it has streamed in (only for the call that runs the request,
+        not for callers coalesced onto it)
         """
         prompt = f"""Analyze this legal document and break it into logical sections.
 For each section, identify:
 1. A heading/title (if present, otherwise generate one)
 2. The body text
 
-Return ONLY a valid JSON object in this exact format:
+Record the result with the record_segments tool, in this shape:
 {{
   "title": "Document title or Bill number",
   "sections": [
@@ -66,19 +325,7 @@ Document text:
 """
         
         try:
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=4000,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            response_text = message.content[0].text
-            # Extract JSON from response
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            json_str = response_text[json_start:json_end]
-            
-            return json.loads(json_str)
+            return self._structured_call("segmentation", text[:8000], prompt, SEGMENT_TOOL, on_item=on_section)
         except Exception as e:
             print(f"Error segmenting document: {e}")
             # Fallback to simple structure
@@ -87,6 +334,7 @@ Document text:
                 "sections": [{"heading": "Full Document", "body": text[:5000]}]
             }
     
+    @coalesce(lambda text: text_key(text))
     def simplify_text(self, text: str) -> Dict:
         """
         Simplify legal text to 8th-grade reading level
@@ -97,7 +345,7 @@ Document text:
 Legal text:
 {text}
 
-Provide your response in this JSON format:
+Record your response with the record_simplification tool, in this shape:
 {{
   "plain_summary": "Simple explanation of what this section means",
   "key_points": ["Point 1", "Point 2", "Point 3"],
@@ -107,32 +355,34 @@ Provide your response in this JSON format:
 
 Keep explanations clear, concise, and accessible to non-lawyers."""
 
+        route = self.router.route("simplification", text)
+        if route["tier"] == "skip":
+            # Too short to be worth a model call; the text already reads plainly
+            self._record_route(route, len(text), 0.0)
+            return {
+                "plain_summary": text.strip(),
+                "key_points": [],
+                "ambiguous_terms": [],
+                "readability_note": "Short section shown as written"
+            }
+        
         try:
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=2000,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            response_text = message.content[0].text
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            json_str = response_text[json_start:json_end]
-            
-            return json.loads(json_str)
+            return self._structured_call("simplification", text, prompt, SIMPLIFY_TOOL, route)
         except Exception as e:
             print(f"Error simplifying text: {e}")
             return {
                 "plain_summary": "Error processing text",
                 "key_points": [],
                 "ambiguous_terms": [],
-                "readability_note": "Processing failed"
+                "readability_note": SIMPLIFY_FAILED_NOTE
             }
     
-    def detect_rights(self, text: str) -> List[Dict]:
+    @coalesce(lambda text, on_right=None: text_key(text))
+    def detect_rights(self, text: str, on_right: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
         """
         Detect and explain rights mentioned in legal documents
-        Returns list of rights with explanations
+        Returns list of rights with explanations; on_right is called with each
+        right as soon as it has streamed in
         """
         prompt = f"""Analyze this legal document and identify any citizen/defendant rights mentioned.
 Common rights include: right to counsel, right to remain silent, right to a translator, 
@@ -141,39 +391,30 @@ right to appeal, right to a speedy trial, etc.
 Document:
 {text}
 
-Return ONLY a valid JSON array in this format:
-[
-  {{
-    "right_name": "Right to Counsel",
-    "plain_explanation": "You have the right to have a lawyer represent you in court. If you cannot afford one, the court may provide one for you.",
-    "location_in_doc": "Section 2, Paragraph 1",
-    "disclaimer": "This is general information, not legal advice. Consult with a qualified attorney for legal advice specific to your situation."
-  }}
-]
+Record them with the record_rights tool, in this shape:
+{{
+  "rights": [
+    {{
+      "right_name": "Right to Counsel",
+      "plain_explanation": "You have the right to have a lawyer represent you in court. If you cannot afford one, the court may provide one for you.",
+      "location_in_doc": "Section 2, Paragraph 1",
+      "disclaimer": "This is general information, not legal advice. Consult with a qualified attorney for legal advice specific to your situation."
+    }}
+  ]
+}}
 
-If no rights are explicitly mentioned, return an empty array: []"""
+If no rights are explicitly mentioned, record an empty rights list."""
 
+        if not text.strip():
+            return []
+        
         try:
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=3000,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            response_text = message.content[0].text
-            # Extract JSON array
-            json_start = response_text.find('[')
-            json_end = response_text.rfind(']') + 1
-            
-            if json_start == -1 or json_end == 0:
-                return []
-            
-            json_str = response_text[json_start:json_end]
-            return json.loads(json_str)
+            return self._structured_call("rights_detection", text, prompt, RIGHTS_TOOL, on_item=on_right)["rights"]
         except Exception as e:
             print(f"Error detecting rights: {e}")
             return []
     
+    @coalesce(lambda text, target_language: text_key(text, target_language.lower()))
     def translate_text(self, text: str, target_language: str) -> str:
         """
         Translate text to target language while preserving legal meaning
@@ -186,18 +427,102 @@ Text to translate:
 
 Provide ONLY the translation, no explanations or additional text."""
 
+        if not text.strip():
+            return ""
+        
+        def attempt(route: Dict):
+            message = self._create_message(prompt, max_tokens=route["max_tokens"], model=route["model"])
+            if message.stop_reason == "max_tokens":
+                raise InvalidOutputError(
+                    f"Response truncated at {route['max_tokens']} tokens", message, message.content[0].text.strip()
+                )
+            try:
+                return self._parse_translation(message.content[0].text), message
+            except ValueError as e:
+                raise InvalidOutputError(str(e), message)
+        
         try:
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=2000,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            return message.content[0].text.strip()
+            return self._routed_call("translation", text, attempt, self.router.route("translation", text, target_language))
+        except InvalidOutputError as e:
+            if e.partial:
+                # A truncated translation is still more useful than an error
+                print(f"Returning truncated translation: {e}")
+                return e.partial
+            print(f"Error translating text: {e}")
+            return f"Translation error: {str(e)}"
         except Exception as e:
             print(f"Error translating text: {e}")
             return f"Translation error: {str(e)}"
     
+    def _many_call(
+        self, operation: str, texts: List[str], prompt: str, tool: Dict, target_language: Optional[str] = None
+    ) -> List[Optional[Dict]]:
+        """
+        Run one multi-item request and map results back by id
+        Items the reply left out come back as None; errors propagate to the caller
+        """
+        joined = "\n".join(texts)
+        route = self.router.route(operation, joined, target_language)
+        if route["tier"] != "skip":
+            # Items are sized one by one; a dense batch routed to the strong tier keeps at least its ceiling
+            budget = sum(self.router.max_tokens_for(operation, text, target_language=target_language) for text in texts)
+            route = {
+                **route,
+                "max_tokens": max(route["max_tokens"], min(BATCH_MAX_TOKENS, budget)),
+                "reason": f"{route['reason']}, batch of {len(texts)}"
+            }
+        result = self._structured_call(operation, joined, prompt, tool, route)
+        by_id = {item["id"]: item for item in result["results"]}
+        return [
+            {key: value for key, value in by_id[i].items() if key != "id"} if i in by_id else None
+            for i in range(len(texts))
+        ]
+    
+    @staticmethod
+    def _numbered(texts: List[str]) -> str:
+        """Lay out passages with the ids the model must echo back"""
+        return "\n\n".join(f"[{i}]\n{text}" for i, text in enumerate(texts))
+    
+    def simplify_many(self, texts: List[str]) -> List[Optional[Dict]]:
+        """
+        Simplify several short passages in one request
+        Returns one simplification per passage, or None where the reply left it out
+        """
+        prompt = f"""Convert each numbered legal passage below into plain language at an 8th-grade reading level.
+
+{self._numbered(texts)}
+
+Record one result per passage with the record_simplifications tool, using the passage number as its id:
+{{
+  "results": [
+    {{
+      "id": 0,
+      "plain_summary": "Simple explanation of what this passage means",
+      "key_points": ["Point 1", "Point 2"],
+      "ambiguous_terms": ["term1: explanation"],
+      "readability_note": "Brief note on complexity"
+    }}
+  ]
+}}
+
+Keep explanations clear, concise, and accessible to non-lawyers."""
+        return self._many_call("simplification", texts, prompt, BATCH_SIMPLIFY_TOOL)
+    
+    def translate_many(self, texts: List[str], target_language: str) -> List[Optional[str]]:
+        """
+        Translate several short passages to one language in one request
+        Returns one translation per passage, or None where the reply left it out
+        """
+        prompt = f"""Translate each numbered passage below to {target_language}.
+Maintain the legal meaning and tone. Be accurate and clear.
+
+{self._numbered(texts)}
+
+Record one result per passage with the record_translations tool, using the passage number as its id.
+Each translation must contain ONLY the translated passage, no explanations or additional text."""
+        results = self._many_call("translation", texts, prompt, BATCH_TRANSLATE_TOOL, target_language)
+        return [result["translation"].strip() if result and result["translation"].strip() else None for result in results]
+    
     def batch_translate(self, text: str, languages: List[str]) -> Dict[str, str]:
         """
         Translate text to multiple languages
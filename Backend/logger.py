@@ -4,32 +4,158 @@ Tracks all transformations for transparency and traceability
 """
 
 import json
+import math
 import os
+import sqlite3
+import threading
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    operation TEXT,
+    model TEXT,
+    input_length INTEGER,
+    latency_ms REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_events (timestamp);
+CREATE INDEX IF NOT EXISTS idx_audit_session ON audit_events (session_id, id);
+CREATE INDEX IF NOT EXISTS idx_audit_type ON audit_events (event_type, timestamp);
+CREATE INDEX IF NOT EXISTS idx_audit_op_size ON audit_events (operation, input_length);
+CREATE INDEX IF NOT EXISTS idx_audit_op_latency ON audit_events (operation, latency_ms);
+CREATE TABLE IF NOT EXISTS operation_histograms (
+    operation TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    hour TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    PRIMARY KEY (operation, metric, bucket, hour, session_id, event_type)
+) WITHOUT ROWID;
+"""
+
+# Metrics that get per-operation percentiles, mapped to their audit_events column
+PERCENTILE_METRICS = {
+    "input_length": "input_length",
+    "latency_ms": "latency_ms",
+}
+
+# Histogram buckets grow by 5%, so a percentile read from them is within about 2.5% of the exact value
+BUCKET_BASE = 1.05
+
+def _bucket(value: float) -> int:
+    """Log-scale histogram bucket for a non-negative metric value"""
+    return int(math.log(max(value, 0) + 1, BUCKET_BASE))
+
+def _bucket_value(bucket: int) -> float:
+    """Representative value for a bucket: the geometric middle of its range"""
+    return round(max(BUCKET_BASE ** (bucket + 0.5) - 1, 0), 2)
+
+def _histogram_rows(timestamp: str, session_id: str, event_type: str, operation: str, metrics: Dict[str, Any]):
+    """Rows to add to operation_histograms for one event; the "count" metric counts every event"""
+    hour = timestamp[:13]
+    rows = [(operation, "count", 0, hour, session_id, event_type, 0.0)]
+    for metric, value in metrics.items():
+        if value is not None:
+            rows.append((operation, metric, _bucket(value), hour, session_id, event_type, float(value)))
+    return rows
+
+HISTOGRAM_UPSERT = (
+    "INSERT INTO operation_histograms (operation, metric, bucket, hour, session_id, event_type, count, total) "
+    "VALUES (?, ?, ?, ?, ?, ?, 1, ?) "
+    "ON CONFLICT (operation, metric, bucket, hour, session_id, event_type) "
+    "DO UPDATE SET count = count + 1, total = total + excluded.total"
+)
 
 class AuditLogger:
-    """Simple JSON-based audit logger"""
-    
-    def __init__(self, log_dir: str = "data/logs"):
+    """SQLite-backed audit logger with indexed queries"""
+
+    def __init__(self, log_dir: str = "data/logs", db_name: str = "audit.db"):
         """Initialize logger with directory"""
         self.log_dir = log_dir
         os.makedirs(log_dir, exist_ok=True)
-        self.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.log_file = os.path.join(log_dir, f"session_{self.session_id}.json")
-        self.logs = []
-    
+        # Worker processes started together share the session id set by the parent
+        self.session_id = os.getenv("LEGISLIGHT_SESSION_ID") or datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.db_path = os.path.join(log_dir, db_name)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # Reads get their own per-thread connections so stats and log queries never wait on writers
+        self._readers = threading.local()
+        self._backfill_histograms()
+
+    def _reader(self) -> sqlite3.Connection:
+        """Read-only connection for the calling thread"""
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA query_only=ON")
+            self._readers.conn = conn
+        return conn
+
+    def _backfill_histograms(self) -> None:
+        """Build histograms for events logged before they were kept"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute("SELECT 1 FROM operation_histograms LIMIT 1").fetchone() is None:
+                    rows = self._conn.execute(
+                        "SELECT timestamp, session_id, event_type, operation, input_length, latency_ms "
+                        "FROM audit_events WHERE operation IS NOT NULL"
+                    )
+                    for row in rows:
+                        metrics = {metric: row[column] for metric, column in PERCENTILE_METRICS.items()}
+                        self._conn.executemany(HISTOGRAM_UPSERT, _histogram_rows(
+                            row["timestamp"], row["session_id"], row["event_type"], row["operation"], metrics
+                        ))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
     def log_event(self, event_type: str, data: Dict[str, Any]) -> None:
         """Log an event with timestamp"""
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "session_id": self.session_id,
-            "event_type": event_type,
-            "data": data
+        timestamp = datetime.now().isoformat()
+        operation = data.get("operation")
+        metrics = {
+            "input_length": data.get("input_length", data.get("text_length", data.get("file_size"))),
+            "latency_ms": data.get("latency_ms"),
         }
-        self.logs.append(log_entry)
-        self._write_to_file()
-    
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO audit_events "
+                    "(timestamp, session_id, event_type, operation, model, input_length, latency_ms, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        timestamp,
+                        self.session_id,
+                        event_type,
+                        operation,
+                        data.get("model"),
+                        metrics["input_length"],
+                        metrics["latency_ms"],
+                        json.dumps(data),
+                    ),
+                )
+                if operation:
+                    self._conn.executemany(HISTOGRAM_UPSERT, _histogram_rows(
+                        timestamp, self.session_id, event_type, operation, metrics
+                    ))
+        except Exception as e:
+            print(f"Error writing audit event: {e}")
+
     def log_document_upload(self, file_name: str, file_size: int, file_type: str) -> None:
         """Log document upload event"""
         self.log_event("document_upload", {
@@ -37,23 +163,26 @@ class AuditLogger:
             "file_size": file_size,
             "file_type": file_type
         })
-    
+
     def log_text_extraction(self, char_count: int, word_count: int) -> None:
         """Log text extraction results"""
         self.log_event("text_extraction", {
             "char_count": char_count,
             "word_count": word_count
         })
-    
-    def log_ai_operation(self, operation: str, input_length: int, output_data: Any, model: str = "claude-3-haiku-20240307") -> None:
+
+    def log_ai_operation(self, operation: str, input_length: int, output_data: Any, model: str = "claude-3-haiku-20240307", latency_ms: Optional[float] = None) -> None:
         """Log AI operation"""
-        self.log_event("ai_operation", {
+        data = {
             "operation": operation,
             "model": model,
             "input_length": input_length,
             "output_preview": str(output_data)[:200] + "..." if len(str(output_data)) > 200 else str(output_data)
-        })
-    
+        }
+        if latency_ms is not None:
+            data["latency_ms"] = round(latency_ms, 2)
+        self.log_event("ai_operation", data)
+
     def log_translation(self, source_lang: str, target_lang: str, text_length: int) -> None:
         """Log translation operation"""
         self.log_event("translation", {
@@ -61,29 +190,157 @@ class AuditLogger:
             "target_language": target_lang,
             "text_length": text_length
         })
-    
+
     def log_error(self, error_type: str, error_message: str) -> None:
         """Log error event"""
         self.log_event("error", {
             "error_type": error_type,
             "error_message": error_message
         })
-    
-    def _write_to_file(self) -> None:
-        """Write logs to JSON file"""
-        try:
-            with open(self.log_file, 'w') as f:
-                json.dump(self.logs, f, indent=2)
-        except Exception as e:
-            print(f"Error writing log file: {e}")
-    
+
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> Dict[str, Any]:
+        """Convert a stored row back to the public log entry shape"""
+        return {
+            "id": row["id"],
+            "timestamp": row["timestamp"],
+            "session_id": row["session_id"],
+            "event_type": row["event_type"],
+            "data": json.loads(row["data"])
+        }
+
+    @staticmethod
+    def _build_filters(
+        session_id: Optional[str],
+        event_types: Optional[List[str]],
+        operation: Optional[str],
+        since: Optional[str],
+        until: Optional[str],
+    ):
+        """Build a WHERE clause and its parameters from query filters"""
+        clauses = []
+        params: List[Any] = []
+        if session_id:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        if event_types:
+            clauses.append(f"event_type IN ({', '.join('?' for _ in event_types)})")
+            params.extend(event_types)
+        if operation:
+            clauses.append("operation = ?")
+            params.append(operation)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        return clauses, params
+
+    def query_logs(
+        self,
+        session_id: Optional[str] = None,
+        event_types: Optional[List[str]] = None,
+        operation: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        cursor: Optional[int] = None,
+        limit: int = 100,
+    ) -> Dict[str, Any]:
+        """
+        Query logs newest-first with filters and cursor pagination
+        Pass the returned next_cursor back in to fetch the following page
+        """
+        clauses, params = self._build_filters(session_id, event_types, operation, since, until)
+        if cursor is not None:
+            clauses.append("id < ?")
+            params.append(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT * FROM audit_events {where} ORDER BY id DESC LIMIT ?"
+
+        rows = self._reader().execute(sql, (*params, limit + 1)).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "logs": [self._row_to_entry(row) for row in rows],
+            "next_cursor": rows[-1]["id"] if has_more else None
+        }
+
+    def aggregate_logs(
+        self,
+        session_id: Optional[str] = None,
+        event_types: Optional[List[str]] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        percentiles: Optional[List[float]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Aggregate events per operation from the pre-built histograms
+        Returns counts plus input size and latency percentiles for each operation;
+        only ai_operation events are counted unless event_types says otherwise,
+        and since and until are applied to whole hours
+        """
+        percentiles = percentiles or [50, 90, 99]
+        event_types = event_types or ["ai_operation"]
+        clauses, params = self._build_filters(session_id, event_types, None, None, None)
+        if since:
+            clauses.append("hour >= ?")
+            params.append(since[:13])
+        if until:
+            clauses.append("hour <= ?")
+            params.append(until[:13])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT operation, metric, bucket, SUM(count) AS count, SUM(total) AS total "
+            f"FROM operation_histograms {where} "
+            f"GROUP BY operation, metric, bucket ORDER BY operation, metric, bucket",
+            params,
+        ).fetchall()
+
+        histograms: Dict[str, Dict[str, List[sqlite3.Row]]] = {}
+        for row in rows:
+            histograms.setdefault(row["operation"], {}).setdefault(row["metric"], []).append(row)
+
+        results = []
+        for operation, metrics in histograms.items():
+            stats = {"operation": operation, "count": sum(row["count"] for row in metrics.get("count", []))}
+            for metric in PERCENTILE_METRICS:
+                buckets = metrics.get(metric, [])
+                total = sum(row["count"] for row in buckets)
+                stats[f"avg_{metric}"] = sum(row["total"] for row in buckets) / total if total else None
+                stats[f"{metric}_percentiles"] = self._percentiles(buckets, total, percentiles)
+            results.append(stats)
+        results.sort(key=lambda stats: stats["count"], reverse=True)
+        return results
+
+    @staticmethod
+    def _percentiles(buckets: List[sqlite3.Row], total: int, percentiles: List[float]) -> Dict[str, Optional[float]]:
+        """Nearest-rank percentiles read from histogram buckets sorted by bucket"""
+        values: Dict[str, Optional[float]] = {f"p{p:g}": None for p in percentiles}
+        if not total:
+            return values
+        for p in percentiles:
+            rank = min(total, max(1, math.ceil(p / 100 * total)))
+            seen = 0
+            for row in buckets:
+                seen += row["count"]
+                if seen >= rank:
+                    values[f"p{p:g}"] = _bucket_value(row["bucket"])
+                    break
+        return values
+
     def get_logs(self) -> list:
         """Return all logs for current session"""
-        return self.logs
-    
+        rows = self._reader().execute(
+            "SELECT * FROM audit_events WHERE session_id = ? ORDER BY id",
+            (self.session_id,),
+        ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
     def export_logs(self) -> str:
         """Export logs as JSON string"""
-        return json.dumps(self.logs, indent=2)
+        return json.dumps(self.get_logs(), indent=2)
 
 
 # Test function
@@ -91,8 +348,9 @@ if __name__ == "__main__":
     logger = AuditLogger()
     logger.log_document_upload("test.pdf", 1024000, "pdf")
     logger.log_text_extraction(5000, 800)
-    logger.log_ai_operation("summarization", 5000, {"summary": "Test summary"})
-    
+    logger.log_ai_operation("summarization", 5000, {"summary": "Test summary"}, latency_ms=850.0)
+
     print("Logs created:")
     print(json.dumps(logger.get_logs(), indent=2))
-
+    print("Per-operation stats:")
+    print(json.dumps(logger.aggregate_logs(session_id=logger.session_id), indent=2))
@@ -3,22 +3,47 @@ FastAPI Backend for LegisLight
 Handles document processing, AI analysis, and translations
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Dict, Optional
+import asyncio
+import contextvars
+import hashlib
+import heapq
+import hmac
 import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
 from dotenv import load_dotenv
 
 from document_processor import DocumentProcessor
-from claude_client import ClaudeClient
+from claude_client import ClaudeClient, SIMPLIFY_FAILED_NOTE
 from logger import AuditLogger
+from micro_batcher import MicroBatcher
+from profiling import Profiler, ProfilingMiddleware, collapsed_text
+from readability import ReadabilityEngine
+from search_index import SearchIndex, ENTRY_KINDS
+from shared_state import SharedStore
 from transcriber import transcribe_audio
 from summarizer import summarize_transcript
 
 # Load environment variables
 load_dotenv()
 
+# Serving configuration
+CPU_COUNT = os.cpu_count() or 1
+WEB_WORKERS = int(os.getenv("WEB_CONCURRENCY", str(CPU_COUNT)))
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(max(1, CPU_COUNT // max(1, WEB_WORKERS)))))
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", "3600"))
+SECTION_WORKERS = int(os.getenv("SECTION_WORKERS", "4"))
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "false").lower() in ("1", "true", "yes")
+# Admin endpoints and per-request profiling are disabled unless a token is configured
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 # Initialize FastAPI app
 app = FastAPI(
     title="LegisLight API",
@@ -35,10 +60,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def is_admin(token: Optional[str]) -> bool:
+    """Check a caller's admin token"""
+    return bool(ADMIN_TOKEN and token and hmac.compare_digest(token, ADMIN_TOKEN))
+
+def require_admin(token: Optional[str]) -> None:
+    """Reject callers without the admin token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not is_admin(token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+# Opt-in profiling: X-Profile: 1 (or ?profile=1) with an admin token profiles one request
+profiler = Profiler()
+app.add_middleware(
+    ProfilingMiddleware,
+    profiler=profiler,
+    is_authorized=lambda headers: is_admin(headers.get("x-admin-token"))
+)
+
 # Initialize services
-claude_client = ClaudeClient()
-doc_processor = DocumentProcessor()
+shared_store = SharedStore()
 logger = AuditLogger()
+claude_client = ClaudeClient(
+    shared_store=shared_store,
+    on_route=lambda record: logger.log_event("route_decision", record)
+)
+# Opt-in: short /api/simplify and /api/translate requests share model calls
+snippet_client = MicroBatcher(claude_client) if MICRO_BATCHING else claude_client
+doc_processor = DocumentProcessor()
+readability = ReadabilityEngine()
+search_index = SearchIndex()
+# Text extraction is CPU-bound, so it runs off the event loop in worker processes
+extraction_pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+# Sections are simplified in threads while segmentation is still streaming
+section_pool = ThreadPoolExecutor(max_workers=SECTION_WORKERS)
+
+@app.on_event("shutdown")
+def shutdown_worker_pools():
+    """Stop extraction worker processes and section threads"""
+    extraction_pool.shutdown(wait=False, cancel_futures=True)
+    section_pool.shutdown(wait=False, cancel_futures=True)
 
 # Request/Response Models
 class AnalyzeRequest(BaseModel):
@@ -51,6 +113,10 @@ class TranslateRequest(BaseModel):
 class SimplifyRequest(BaseModel):
     text: str
 
+class ProfilingConfig(BaseModel):
+    sample_rate: Optional[float] = None
+    interval_ms: Optional[float] = None
+
 # API Endpoints
 
 @app.get("/")
@@ -62,7 +128,40 @@ async def root():
         "version": "1.0.0"
     }
 
+def process_upload(contents: bytes, file_name: str) -> Dict:
+    """Extract, log and index an uploaded document; blocking, so run it off the event loop"""
+    # Process document, reusing a result another worker may already have extracted
+    cache_key = f"extract:{hashlib.sha256(contents).hexdigest()}:{file_name.lower().split('.')[-1]}"
+    result = None if profiler.active() else shared_store.cache_get(cache_key)
+    if result is None and profiler.active():
+        # Extract inline so PyPDF2 and clean_text show up in the request's profile
+        result = DocumentProcessor.process_document(contents, file_name)
+    elif result is None:
+        result = extraction_pool.submit(DocumentProcessor.process_document, contents, file_name).result()
+        shared_store.cache_set(cache_key, result, ttl=EXTRACTION_CACHE_TTL)
+    else:
+        result = {**result, "file_name": file_name}
+    
+    # Log upload
+    logger.log_document_upload(
+        file_name,
+        len(contents),
+        result['file_type']
+    )
+    logger.log_text_extraction(
+        result['char_count'],
+        result['word_count']
+    )
+    
+    # Make the document searchable
+    try:
+        result = {**result, "doc_id": search_index.index_document(result)}
+    except Exception as e:
+        logger.log_error("search_indexing", str(e))
+    return result
+
 @app.post("/api/upload")
+@profiler.profiled
 async def upload_document(file: UploadFile = File(...)):
     """
     Upload and process a document
@@ -72,18 +171,10 @@ async def upload_document(file: UploadFile = File(...)):
         # Read file
         contents = await file.read()
         
-        # Process document
-        result = doc_processor.process_document(contents, file.filename)
-        
-        # Log upload
-        logger.log_document_upload(
-            file.filename,
-            len(contents),
-            result['file_type']
-        )
-        logger.log_text_extraction(
-            result['char_count'],
-            result['word_count']
+        # Cache, extraction, logging and indexing all block, so they run in a worker thread
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            None, contextvars.copy_context().run, profiler.traced(process_upload), contents, file.filename
         )
         
         return {
@@ -95,29 +186,86 @@ async def upload_document(file: UploadFile = File(...)):
         logger.log_error("document_upload", str(e))
         raise HTTPException(status_code=400, detail=str(e))
 
+# Plain def endpoints run in FastAPI's threadpool, so concurrent requests reach
+# ClaudeClient in parallel and identical in-flight calls are coalesced
 @app.post("/api/analyze")
-async def analyze_document(request: AnalyzeRequest, text: str):
+@profiler.profiled
+def analyze_document(request: AnalyzeRequest, text: str):
     """
     Analyze document with AI
     Returns segmented sections, simplified text, and detected rights
     """
+    def simplify_section(body: str, metrics: Dict) -> Dict:
+        start = time.perf_counter()
+        simplified = claude_client.simplify_text(body)
+        logger.log_ai_operation("simplification", len(body), simplified,
+                                latency_ms=(time.perf_counter() - start) * 1000)
+        if simplified.get("readability_note") == SIMPLIFY_FAILED_NOTE:
+            # Keep the failure visible rather than covering it with the local note
+            return {**simplified, "readability": metrics}
+        # The complexity note is measured locally rather than taken from the model
+        return {**simplified, "readability_note": readability.note(metrics), "readability": metrics}
+    
+    pending = {}
+    # Sections waiting for a section_pool thread, hardest first
+    queue = []
+    queue_lock = threading.Lock()
+    
+    def simplify_hardest() -> None:
+        with queue_lock:
+            _, _, body, metrics, future = heapq.heappop(queue)
+        try:
+            future.set_result(simplify_section(body, metrics))
+        except Exception as e:
+            future.set_exception(e)
+    
+    def start_simplification(section: Dict, metrics: Optional[Dict] = None) -> None:
+        body = section['body']
+        if body in pending:
+            return
+        metrics = metrics or readability.score(body)
+        future = Future()
+        pending[body] = future
+        if not readability.needs_simplification(metrics):
+            # Already at or below the target reading level; no model call needed
+            future.set_result(readability.plain_result(body, metrics))
+            return
+        with queue_lock:
+            heapq.heappush(queue, (-metrics['difficulty'], len(pending), body, metrics, future))
+        # Each task takes whichever queued section is hardest when a thread frees up,
+        # so streamed sections that pile up behind busy threads are worked hardest first
+        section_pool.submit(contextvars.copy_context().run, profiler.traced(simplify_hardest))
+    
     try:
-        # Segment document
-        segmented = claude_client.segment_document(text)
-        logger.log_ai_operation("segmentation", len(text), segmented)
+        # Segment document, starting simplification of each section as it streams in
+        start = time.perf_counter()
+        segmented = claude_client.segment_document(text, on_section=start_simplification)
+        logger.log_ai_operation("segmentation", len(text), segmented,
+                                latency_ms=(time.perf_counter() - start) * 1000)
+        
+        # Simplify the sections that did not stream in, hardest first
+        remaining = [section for section in segmented['sections'] if section['body'] not in pending]
+        scored = zip(remaining, readability.score_many([section['body'] for section in remaining]))
+        for section, metrics in sorted(scored, key=lambda pair: pair[1]['difficulty'], reverse=True):
+            start_simplification(section, metrics)
         
-        # Simplify each section
         simplified_sections = {}
         for section in segmented['sections']:
-            simplified = claude_client.simplify_text(section['body'])
-            simplified_sections[section['heading']] = simplified
-            logger.log_ai_operation("simplification", len(section['body']), simplified)
+            simplified_sections[section['heading']] = pending[section['body']].result()
         
         # Detect rights if requested
         detected_rights = []
         if request.detect_rights:
+            start = time.perf_counter()
             detected_rights = claude_client.detect_rights(text)
-            logger.log_ai_operation("rights_detection", len(text), detected_rights)
+            logger.log_ai_operation("rights_detection", len(text), detected_rights,
+                                    latency_ms=(time.perf_counter() - start) * 1000)
+        
+        # Make sections, summaries and rights searchable
+        try:
+            search_index.index_analysis(text, segmented, simplified_sections, detected_rights)
+        except Exception as e:
+            logger.log_error("search_indexing", str(e))
         
         return {
             "success": True,
@@ -133,12 +281,13 @@ async def analyze_document(request: AnalyzeRequest, text: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/translate")
-async def translate_text(request: TranslateRequest):
+@profiler.profiled
+def translate_text(request: TranslateRequest):
     """
     Translate text to target language
     """
     try:
-        translation = claude_client.translate_text(
+        translation = snippet_client.translate_text(
             request.text,
             request.target_language
         )
@@ -162,14 +311,17 @@ async def translate_text(request: TranslateRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/simplify")
-async def simplify_text(request: SimplifyRequest):
+@profiler.profiled
+def simplify_text(request: SimplifyRequest):
     """
     Simplify text to plain language
     """
     try:
-        simplified = claude_client.simplify_text(request.text)
+        start = time.perf_counter()
+        simplified = snippet_client.simplify_text(request.text)
         
-        logger.log_ai_operation("simplification", len(request.text), simplified)
+        logger.log_ai_operation("simplification", len(request.text), simplified,
+                                latency_ms=(time.perf_counter() - start) * 1000)
         
         return {
             "success": True,
@@ -181,23 +333,117 @@ async def simplify_text(request: SimplifyRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/logs")
-async def get_logs():
+def get_logs(
+    session_id: Optional[str] = None,
+    all_sessions: bool = False,
+    event_type: Optional[List[str]] = Query(None),
+    operation: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """
+    Get audit logs, newest first
+    Defaults to the current session; pass session_id or all_sessions for earlier ones.
+    Use the returned next_cursor to fetch the following page.
+    """
+    try:
+        result = logger.query_logs(
+            session_id=None if all_sessions else (session_id or logger.session_id),
+            event_types=event_type,
+            operation=operation,
+            since=since,
+            until=until,
+            cursor=cursor,
+            limit=limit
+        )
+        return {
+            "success": True,
+            "data": {
+                "logs": result["logs"],
+                "count": len(result["logs"]),
+                "next_cursor": result["next_cursor"]
+            }
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/logs/stats")
+def get_log_stats(
+    session_id: Optional[str] = None,
+    all_sessions: bool = False,
+    event_type: Optional[List[str]] = Query(None),
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    percentile: Optional[List[float]] = Query(None)
+):
+    """
+    Get per-operation counts with input size and latency percentiles
+    Percentiles come from log-scale histograms and are within about 2.5% of the exact value
+    """
+    try:
+        stats = logger.aggregate_logs(
+            session_id=None if all_sessions else (session_id or logger.session_id),
+            event_types=event_type,
+            since=since,
+            until=until,
+            percentiles=percentile
+        )
+        return {
+            "success": True,
+            "data": {
+                "operations": stats,
+                "coalescing": claude_client.single_flight.stats(),
+                "micro_batching": snippet_client.stats() if MICRO_BATCHING else None
+            }
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/search")
+@profiler.profiled
+def search_documents(
+    q: str,
+    kind: Optional[List[str]] = Query(None),
+    file_type: Optional[str] = None,
+    doc_id: Optional[str] = None,
+    since: Optional[str] = None,
+    match_all: bool = True,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
     """
-    Get audit logs for current session
+    Search previously processed documents, summaries and rights
+    kind filters entries to document, section, simplification or right
     """
+    if kind and not set(kind) <= set(ENTRY_KINDS):
+        raise HTTPException(status_code=400, detail=f"Unknown kind. Supported: {', '.join(ENTRY_KINDS)}")
     try:
-        logs = logger.get_logs()
+        result = search_index.search(
+            q,
+            kinds=kind,
+            file_type=file_type,
+            doc_id=doc_id,
+            since=since,
+            match_all=match_all,
+            limit=limit,
+            offset=offset
+        )
         return {
             "success": True,
             "data": {
-                "logs": logs,
-                "count": len(logs)
+                "results": result["results"],
+                "count": len(result["results"]),
+                "query": result["query"]
             }
         }
     except Exception as e:
+        logger.log_error("search", str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/audio/upload")
+@profiler.profiled
 async def upload_audio(file: UploadFile = File(...)):
     """
     Upload and process audio file (courtroom recording, etc.)
@@ -262,6 +508,76 @@ async def upload_audio(file: UploadFile = File(...)):
             os.remove(temp_audio_path)
         raise HTTPException(status_code=500, detail=f"Audio processing error: {str(e)}")
 
+@app.get("/api/admin/profiling")
+async def get_profiling(x_admin_token: Optional[str] = Header(None)):
+    """
+    Get sampling settings and the most recent request profiles
+    """
+    require_admin(x_admin_token)
+    return {
+        "success": True,
+        "data": {
+            "settings": profiler.settings(),
+            "profiles": profiler.recent()
+        }
+    }
+
+@app.post("/api/admin/profiling")
+async def configure_profiling(config: ProfilingConfig, x_admin_token: Optional[str] = Header(None)):
+    """
+    Change the share of traffic that is stack-sampled (0 turns sampling off)
+    """
+    require_admin(x_admin_token)
+    return {
+        "success": True,
+        "data": profiler.configure(config.sample_rate, config.interval_ms)
+    }
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "json", x_admin_token: Optional[str] = Header(None)):
+    """
+    Get one request profile; format=collapsed returns flame-graph input as plain text
+    """
+    require_admin(x_admin_token)
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    data = profile.to_dict()
+    if format == "collapsed":
+        return PlainTextResponse(collapsed_text(data["flamegraph"]))
+    return {
+        "success": True,
+        "data": data
+    }
+
+@app.get("/api/admin/flamegraph")
+async def get_flamegraph(format: str = "json", x_admin_token: Optional[str] = Header(None)):
+    """
+    Get stacks aggregated from sampled traffic; format=collapsed returns plain text
+    """
+    require_admin(x_admin_token)
+    stacks = profiler.flamegraph()
+    if format == "collapsed":
+        return PlainTextResponse(collapsed_text(stacks))
+    return {
+        "success": True,
+        "data": {
+            "stacks": stacks,
+            "settings": profiler.settings()
+        }
+    }
+
+@app.delete("/api/admin/flamegraph")
+async def reset_flamegraph(x_admin_token: Optional[str] = Header(None)):
+    """
+    Clear sampled stacks and stored request profiles
+    """
+    require_admin(x_admin_token)
+    profiler.reset()
+    return {
+        "success": True
+    }
+
 @app.get("/api/test-claude")
 async def test_claude():
     """
@@ -278,5 +594,11 @@ async def test_claude():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    # Every worker inherits this, so they all log under one audit session
+    os.environ.setdefault("LEGISLIGHT_SESSION_ID", datetime.now().strftime("%Y%m%d_%H%M%S"))
+    if os.getenv("LEGISLIGHT_ENV") == "production":
+        # Pre-forked workers, one per core unless WEB_CONCURRENCY says otherwise
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WEB_WORKERS)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
@@ -0,0 +1,181 @@
+"""
+Micro-Batching for LegisLight
+Collects short simplify and translate requests for a few milliseconds and sends them
+to Claude as one multi-item prompt
+"""
+
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from single_flight import normalize_text
+
+class _Batch:
+    """Requests waiting to be sent together"""
+
+    def __init__(self):
+        self.items: List[Tuple[str, Future]] = []
+        self.chars = 0
+        self.timer: Optional[threading.Timer] = None
+
+class MicroBatcher:
+    """
+    Drop-in front end for ClaudeClient.simplify_text and translate_text
+    Short requests that arrive within max_wait_ms of each other share one model call;
+    long requests and items a batch fails on are sent on their own
+    """
+
+    def __init__(
+        self,
+        client,
+        max_wait_ms: Optional[float] = None,
+        max_items: Optional[int] = None,
+        max_item_chars: Optional[int] = None,
+        max_batch_chars: Optional[int] = None,
+    ):
+        """Initialize batching limits, overridable through environment variables"""
+        self.client = client
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else float(os.getenv("BATCH_MAX_WAIT_MS", "15"))) / 1000
+        self.max_items = max_items or int(os.getenv("BATCH_MAX_ITEMS", "8"))
+        self.max_item_chars = max_item_chars or int(os.getenv("BATCH_MAX_ITEM_CHARS", "800"))
+        self.max_batch_chars = max_batch_chars or int(os.getenv("BATCH_MAX_CHARS", "6000"))
+        self._lock = threading.Lock()
+        self._batches: Dict[Hashable, _Batch] = {}
+        self.requests = 0
+        self.model_calls = 0
+
+    def simplify_text(self, text: str) -> Dict:
+        """Simplify text, batched with other short requests when possible"""
+        if len(text) > self.max_item_chars or self.client.router.route("simplification", text)["tier"] == "skip":
+            return self.client.simplify_text(text)
+        return self._submit(
+            ("simplification",),
+            text,
+            self.client.simplify_many,
+            self.client.simplify_text,
+        )
+
+    def translate_text(self, text: str, target_language: str) -> str:
+        """Translate text, batched with other short requests for the same language when possible"""
+        if len(text) > self.max_item_chars or not text.strip():
+            return self.client.translate_text(text, target_language)
+        return self._submit(
+            ("translation", target_language.strip().lower()),
+            text,
+            lambda texts: self.client.translate_many(texts, target_language),
+            lambda single: self.client.translate_text(single, target_language),
+        )
+
+    def _submit(
+        self,
+        key: Hashable,
+        text: str,
+        send_many: Callable[[List[str]], List[Optional[Any]]],
+        send_one: Callable[[str], Any],
+    ) -> Any:
+        """Queue text in the open batch for key and wait for its result"""
+        future: Future = Future()
+        ready = []
+        with self._lock:
+            self.requests += 1
+            batch = self._batches.get(key)
+            if batch is not None and batch.chars + len(text) > self.max_batch_chars:
+                ready.append(self._close(key))
+                batch = None
+            if batch is None:
+                batch = _Batch()
+                self._batches[key] = batch
+                batch.timer = threading.Timer(self.max_wait, self._flush_key, (key, send_many, send_one))
+                batch.timer.daemon = True
+                batch.timer.start()
+            batch.items.append((text, future))
+            batch.chars += len(text)
+            if len(batch.items) >= self.max_items:
+                ready.append(self._close(key))
+
+        # Full batches go out now rather than waiting for their timer
+        for full in ready:
+            threading.Thread(target=self._flush, args=(full, send_many, send_one), daemon=True).start()
+        return future.result()
+
+    def _close(self, key: Hashable) -> _Batch:
+        """Detach the open batch for key; callers hold the lock"""
+        batch = self._batches.pop(key)
+        batch.timer.cancel()
+        return batch
+
+    def _flush_key(self, key: Hashable, send_many, send_one) -> None:
+        """Timer callback: send whatever has collected for key"""
+        with self._lock:
+            batch = self._batches.get(key)
+            if batch is None or batch.timer is not threading.current_thread():
+                return
+            self._close(key)
+        self._flush(batch, send_many, send_one)
+
+    def _flush(self, batch: _Batch, send_many, send_one) -> None:
+        """Send one batch and hand each caller its own result or error"""
+        # Identical texts in one batch are sent once
+        unique: Dict[str, int] = {}
+        texts: List[str] = []
+        for text, _ in batch.items:
+            normalized = normalize_text(text)
+            if normalized not in unique:
+                unique[normalized] = len(texts)
+                texts.append(text)
+
+        results: List[Optional[Any]] = [None] * len(texts)
+        if len(texts) > 1:
+            with self._lock:
+                self.model_calls += 1
+            try:
+                results = send_many(texts)
+            except Exception as e:
+                print(f"Error in batched request, retrying items individually: {e}")
+
+        errors: Dict[int, Exception] = {}
+        for text, future in batch.items:
+            index = unique[normalize_text(text)]
+            if results[index] is None and index not in errors:
+                # Items the batch did not answer are isolated and sent on their own
+                with self._lock:
+                    self.model_calls += 1
+                try:
+                    results[index] = send_one(texts[index])
+                except Exception as e:
+                    errors[index] = e
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(results[index])
+
+    def stats(self) -> Dict[str, int]:
+        """Requests received and model calls made through the batcher"""
+        with self._lock:
+            return {"requests": self.requests, "model_calls": self.model_calls}
+
+
+# Test function
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    class EchoClient:
+        """Stands in for ClaudeClient so batching can be watched without API calls"""
+
+        class router:
+            @staticmethod
+            def route(operation, text):
+                return {"tier": "fast"}
+
+        def simplify_many(self, texts):
+            print(f"One model call for {len(texts)} passages")
+            return [{"plain_summary": text.upper()} for text in texts]
+
+        def simplify_text(self, text):
+            return {"plain_summary": text.upper()}
+
+    batcher = MicroBatcher(EchoClient(), max_wait_ms=20)
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        results = list(pool.map(batcher.simplify_text, [f"clause {i}" for i in range(12)]))
+    print(results[:2], batcher.stats())
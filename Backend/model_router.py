@@ -0,0 +1,170 @@
+"""
+Model Routing for LegisLight
+Picks the model tier and output-token budget for each Claude call from input size and complexity
+"""
+
+import os
+import re
+from typing import Dict, Optional
+
+# Words that mark dense legal drafting; a high share pushes a section toward the stronger tier
+LEGAL_JARGON = {
+    "aforementioned", "herein", "hereinafter", "hereby", "hereof", "hereto", "heretofore",
+    "notwithstanding", "pursuant", "thereof", "therein", "thereto", "whereas", "whereby",
+    "wherein", "foregoing", "indemnify", "indemnification", "jurisdiction", "liability",
+    "provision", "provisions", "statute", "statutory", "subsection", "subparagraph",
+    "shall", "deemed", "enacted", "plaintiff", "defendant", "respondent", "petitioner",
+    "tort", "lien", "remedy", "remedies", "injunction", "stipulation", "affidavit",
+}
+
+WORD_RE = re.compile(r"[A-Za-z']+")
+SENTENCE_RE = re.compile(r"[.!?;:]+")
+
+# Per-operation output budgets: max_tokens = base + ratio * estimated input tokens, clamped to [floor, ceiling]
+OUTPUT_BUDGETS = {
+    "segmentation": {"base": 200, "ratio": 1.2, "floor": 500, "ceiling": 4000},
+    "simplification": {"base": 300, "ratio": 0.6, "floor": 400, "ceiling": 2000},
+    "rights_detection": {"base": 400, "ratio": 0.3, "floor": 500, "ceiling": 3000},
+    "translation": {"base": 100, "ratio": 1.5, "floor": 200, "ceiling": 2000},
+}
+
+# Most output tokens the models accept in one reply
+MODEL_OUTPUT_LIMIT = 4096
+
+# Target languages whose scripts cost several tokens per word; translations into them get a larger budget
+DENSE_SCRIPT_LANGUAGES = {
+    "amharic", "arabic", "bengali", "cantonese", "chinese", "farsi", "greek", "gujarati", "hebrew", "hindi",
+    "japanese", "kannada", "korean", "malayalam", "mandarin", "marathi", "nepali", "persian", "punjabi",
+    "russian", "tamil", "telugu", "thai", "ukrainian", "urdu", "vietnamese",
+}
+DENSE_SCRIPT_FACTOR = 2.5
+
+class ModelRouter:
+    """Chooses a model tier and max_tokens per call, and escalates on failed validation"""
+
+    def __init__(
+        self,
+        fast_model: str = "claude-3-haiku-20240307",
+        strong_model: Optional[str] = None,
+        strong_threshold: Optional[float] = None,
+        trivial_word_limit: Optional[int] = None,
+    ):
+        """
+        Initialize routing thresholds, overridable through environment variables
+        Without a configured strong model the strong tier reuses the fast model with a larger output budget
+        """
+        self.models = {
+            "fast": fast_model,
+            "strong": strong_model or os.getenv("ANTHROPIC_STRONG_MODEL") or fast_model,
+        }
+        self.strong_threshold = strong_threshold if strong_threshold is not None else float(os.getenv("ROUTER_STRONG_THRESHOLD", "0.75"))
+        self.trivial_word_limit = trivial_word_limit if trivial_word_limit is not None else int(os.getenv("ROUTER_TRIVIAL_WORDS", "12"))
+
+    @staticmethod
+    def complexity(text: str) -> Dict[str, float]:
+        """Estimate how hard a passage is from sentence length and jargon density"""
+        words = WORD_RE.findall(text)
+        word_count = len(words)
+        if not word_count:
+            return {"word_count": 0, "avg_sentence_words": 0.0, "jargon_density": 0.0, "score": 0.0}
+
+        sentences = max(1, len([s for s in SENTENCE_RE.split(text) if s.strip()]))
+        avg_sentence_words = word_count / sentences
+        jargon_density = sum(1 for w in words if w.lower() in LEGAL_JARGON) / word_count
+        long_words = sum(1 for w in words if len(w) >= 9) / word_count
+
+        # Each signal is normalised to roughly 0..1 before weighting
+        score = (
+            0.4 * min(avg_sentence_words / 40, 1.0)
+            + 0.4 * min(jargon_density / 0.08, 1.0)
+            + 0.2 * min(long_words / 0.2, 1.0)
+        )
+        return {
+            "word_count": word_count,
+            "avg_sentence_words": round(avg_sentence_words, 2),
+            "jargon_density": round(jargon_density, 4),
+            "score": round(score, 3),
+        }
+
+    @staticmethod
+    def _scale(operation: str, target_language: Optional[str]) -> float:
+        """Budget multiplier for translations into scripts that take more tokens"""
+        if operation == "translation" and target_language and target_language.strip().lower() in DENSE_SCRIPT_LANGUAGES:
+            return DENSE_SCRIPT_FACTOR
+        return 1.0
+
+    @classmethod
+    def ceiling_for(cls, operation: str, target_language: Optional[str] = None) -> int:
+        """Largest output budget an operation may get"""
+        return int(min(MODEL_OUTPUT_LIMIT, OUTPUT_BUDGETS[operation]["ceiling"] * cls._scale(operation, target_language)))
+
+    @classmethod
+    def max_tokens_for(cls, operation: str, text: str, tier: str = "fast", target_language: Optional[str] = None) -> int:
+        """Size the output budget from the input length; the strong tier always gets the ceiling"""
+        budget = OUTPUT_BUDGETS[operation]
+        ceiling = cls.ceiling_for(operation, target_language)
+        if tier == "strong":
+            return ceiling
+        estimated_input_tokens = len(text) / 4
+        scale = cls._scale(operation, target_language)
+        tokens = scale * (budget["base"] + budget["ratio"] * estimated_input_tokens)
+        return int(min(ceiling, max(scale * budget["floor"], tokens)))
+
+    def route(self, operation: str, text: str, target_language: Optional[str] = None) -> Dict:
+        """Return the route for a call: tier, model, max_tokens and the reason behind it"""
+        stats = self.complexity(text)
+
+        if not text.strip():
+            return {"operation": operation, "tier": "skip", "model": None, "max_tokens": 0,
+                    "reason": "empty input", "complexity": stats}
+        if operation == "simplification" and stats["word_count"] <= self.trivial_word_limit:
+            return {"operation": operation, "tier": "skip", "model": None, "max_tokens": 0,
+                    "reason": "trivial section", "complexity": stats}
+
+        if stats["score"] >= self.strong_threshold and stats["word_count"] >= 150:
+            tier, reason = "strong", "dense input"
+        else:
+            tier, reason = "fast", "default"
+        return {
+            "operation": operation,
+            "tier": tier,
+            "model": self.models[tier],
+            "max_tokens": self.max_tokens_for(operation, text, tier, target_language),
+            "ceiling": self.ceiling_for(operation, target_language),
+            "reason": reason,
+            "complexity": stats,
+        }
+
+    def escalate(self, route: Dict) -> Optional[Dict]:
+        """
+        Return the next route after a failed validation, or None if already at the top tier
+        or if escalating would resend the same request: same model and no larger budget
+        """
+        if route["tier"] != "fast":
+            return None
+        # Batched routes may already be above the single-item ceiling
+        max_tokens = max(route["max_tokens"], route.get("ceiling", OUTPUT_BUDGETS[route["operation"]]["ceiling"]))
+        if self.models["strong"] == route["model"] and max_tokens == route["max_tokens"]:
+            return None
+        return {
+            **route,
+            "tier": "strong",
+            "model": self.models["strong"],
+            "max_tokens": max_tokens,
+            "reason": "escalated after failed validation",
+        }
+
+
+# Test function
+if __name__ == "__main__":
+    router = ModelRouter()
+    samples = {
+        "Short Title": "This Act may be cited as the Example Legal Act.",
+        "Dense clause": (
+            "Notwithstanding any provision of this subsection to the contrary, the respondent shall be deemed "
+            "liable pursuant to the foregoing statutory remedies, whereby indemnification hereinafter described "
+            "shall apply to all parties hereto. " * 8
+        ),
+    }
+    for name, text in samples.items():
+        print(name, router.route("simplification", text))
@@ -0,0 +1,399 @@
+"""
+Request Profiling for LegisLight
+Opt-in per-request profiles and low-overhead stack sampling, exported as flame-graph data
+"""
+
+import asyncio
+import contextvars
+import cProfile
+import functools
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+
+_current_profile: contextvars.ContextVar = contextvars.ContextVar("request_profile", default=None)
+
+# From Python 3.12 cProfile hooks every thread in the process, so its stats would mix in other
+# requests' calls; there flagged requests get per-thread CPU time and stack samples only
+PER_THREAD_CPROFILE = sys.version_info < (3, 12)
+
+# One cProfile at a time per process, so flagged requests that find it taken are stack-sampled only
+_cprofile_lock = threading.Lock()
+
+def collapse_stack(frame) -> str:
+    """Render a frame and its callers root-first in the collapsed format flame-graph tools read"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    """
+    Background thread that samples the stacks of watched threads; it only runs while something is watched
+    Each sample is weighted by the microseconds since the previous one, so sinks hold wall time per stack
+    """
+
+    def __init__(self, interval: float = 0.005):
+        """interval is the time between samples in seconds"""
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._watched: Dict[int, List[Counter]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, thread_id: int, sink: Counter) -> None:
+        """Start counting samples of thread_id into sink"""
+        with self._lock:
+            self._watched.setdefault(thread_id, []).append(sink)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def unwatch(self, thread_id: int, sink: Counter) -> None:
+        """Stop counting samples of thread_id into sink"""
+        with self._lock:
+            sinks = self._watched.get(thread_id, [])
+            # Counters compare by content, so match the sink by identity
+            for i, watched in enumerate(sinks):
+                if watched is sink:
+                    del sinks[i]
+                    break
+            if not sinks:
+                self._watched.pop(thread_id, None)
+
+    def _run(self) -> None:
+        """Sample until nothing is watched, then exit"""
+        last = time.perf_counter()
+        while True:
+            with self._lock:
+                if not self._watched:
+                    self._thread = None
+                    return
+                watched = {thread_id: list(sinks) for thread_id, sinks in self._watched.items()}
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            elapsed_us = int((now - last) * 1_000_000)
+            last = now
+            for thread_id, sinks in watched.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = collapse_stack(frame)
+                with self._lock:
+                    for sink in sinks:
+                        sink[stack] += elapsed_us
+            del frames
+            time.sleep(self.interval)
+
+class RequestProfile:
+    """
+    Profile of one request: CPU time of its threads, CPU per function from cProfile (before Python 3.12)
+    and wall time per function from stack samples
+    """
+
+    def __init__(self, path: str, full: bool, sink: Counter):
+        self.id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.full = full
+        self.started_at = datetime.now().isoformat()
+        self.sink = sink
+        self.wall_ms = 0.0
+        self.cpu_ms = 0.0
+        self.cpu_profiled = False
+        self.functions: List[Dict[str, Any]] = []
+        self._stats: Optional[pstats.Stats] = None
+        self._token = None
+        self._wall_start = time.perf_counter()
+
+    def record_stats(self, profile: cProfile.Profile) -> None:
+        """Merge in a finished cProfile and keep the functions that used the most CPU"""
+        if self._stats is None:
+            self._stats = pstats.Stats(profile)
+        else:
+            self._stats.add(profile)
+        rows = []
+        for (filename, line, name), (_, calls, self_time, total_time, _) in self._stats.stats.items():
+            rows.append({
+                "function": f"{os.path.basename(filename)}:{line}({name})",
+                "calls": calls,
+                "cpu_self_ms": round(self_time * 1000, 3),
+                "cpu_total_ms": round(total_time * 1000, 3)
+            })
+        rows.sort(key=lambda row: row["cpu_total_ms"], reverse=True)
+        self.functions = rows[:50]
+
+    def wall_by_function(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Inclusive wall time per function, estimated from stack samples"""
+        totals: Counter = Counter()
+        for stack, wall_us in self.sink.items():
+            for name in set(stack.split(";")):
+                totals[name] += wall_us
+        return [
+            {"function": name, "wall_ms": round(wall_us / 1000, 2)}
+            for name, wall_us in totals.most_common(limit)
+        ]
+
+    def summary(self) -> Dict[str, Any]:
+        """Headline numbers for listings"""
+        return {
+            "id": self.id,
+            "path": self.path,
+            "started_at": self.started_at,
+            "wall_ms": round(self.wall_ms, 2),
+            "cpu_ms": round(self.cpu_ms, 2),
+            "cpu_profiled": self.cpu_profiled
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Full profile, including flame-graph stacks"""
+        return {
+            **self.summary(),
+            "cpu_by_function": self.functions,
+            "wall_by_function": self.wall_by_function(),
+            "flamegraph": [{"stack": stack, "wall_us": wall_us} for stack, wall_us in self.sink.most_common()]
+        }
+
+class Profiler:
+    """
+    Opt-in profiling front end
+    Requests flagged by an admin are fully profiled; a configurable share of other
+    requests is stack-sampled into a process-wide flame graph. With both off, the
+    only per-request cost is a context-variable lookup.
+    """
+
+    def __init__(self, interval_ms: Optional[float] = None, sample_rate: Optional[float] = None, keep: int = 50):
+        """Defaults can be set with PROFILE_INTERVAL_MS and PROFILE_SAMPLE_RATE"""
+        self.sampler = StackSampler((interval_ms or float(os.getenv("PROFILE_INTERVAL_MS", "5"))) / 1000)
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        self.aggregate: Counter = Counter()
+        self.sampled_requests = 0
+        self._profiles: deque = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def configure(self, sample_rate: Optional[float] = None, interval_ms: Optional[float] = None) -> Dict[str, float]:
+        """Change sampling at runtime"""
+        if sample_rate is not None:
+            self.sample_rate = min(1.0, max(0.0, sample_rate))
+        if interval_ms is not None:
+            self.sampler.interval = max(0.001, interval_ms / 1000)
+        return self.settings()
+
+    def settings(self) -> Dict[str, float]:
+        """Current sampling settings"""
+        return {
+            "sample_rate": self.sample_rate,
+            "interval_ms": self.sampler.interval * 1000,
+            "sampled_requests": self.sampled_requests
+        }
+
+    def start_request(self, path: str, explicit: bool) -> Optional[RequestProfile]:
+        """Decide whether to profile a request; returns its profile, or None when it is not profiled"""
+        if explicit:
+            profile = RequestProfile(path, True, Counter())
+        elif self.sample_rate and random.random() < self.sample_rate:
+            profile = RequestProfile(path, False, self.aggregate)
+            self.sampled_requests += 1
+        else:
+            return None
+        profile._token = _current_profile.set(profile)
+        return profile
+
+    def finish_request(self, profile: RequestProfile) -> None:
+        """Close a request's profile and keep it if it was explicitly requested"""
+        profile.wall_ms = (time.perf_counter() - profile._wall_start) * 1000
+        _current_profile.reset(profile._token)
+        if profile.full:
+            with self._lock:
+                self._profiles.append(profile)
+
+    @staticmethod
+    def active() -> bool:
+        """True while the current request is fully profiled"""
+        profile = _current_profile.get()
+        return profile is not None and profile.full
+
+    def _watch(self, profile: RequestProfile):
+        """Sample the calling thread into the profile until the returned callback is called"""
+        thread_id = threading.get_ident()
+        self.sampler.watch(thread_id, profile.sink)
+        return lambda: self.sampler.unwatch(thread_id, profile.sink)
+
+    def _begin(self, profile: RequestProfile, cpu: bool) -> Callable[[], None]:
+        """
+        Start sampling the calling thread and, when cpu is set, measure its CPU time;
+        before Python 3.12, and when no other request holds it, cProfile it as well
+        Returns the callback that stops everything; profiling errors are reported, never raised
+        """
+        stops = []
+        try:
+            stops.append(self._watch(profile))
+            if cpu:
+                cpu_start = time.thread_time()
+
+                def stop_cpu_time() -> None:
+                    cpu_ms = (time.thread_time() - cpu_start) * 1000
+                    with self._lock:
+                        profile.cpu_ms += cpu_ms
+                stops.append(stop_cpu_time)
+            if cpu and PER_THREAD_CPROFILE and _cprofile_lock.acquire(blocking=False):
+                stops.append(_cprofile_lock.release)
+                cpu_profile = cProfile.Profile(time.thread_time)
+                cpu_profile.enable()
+
+                def stop_cprofile() -> None:
+                    cpu_profile.disable()
+                    profile.cpu_profiled = True
+                    profile.record_stats(cpu_profile)
+                stops.append(stop_cprofile)
+        except Exception as e:
+            print(f"Error starting profiler: {e}")
+
+        def stop() -> None:
+            for stop_one in reversed(stops):
+                try:
+                    stop_one()
+                except Exception as e:
+                    print(f"Error stopping profiler: {e}")
+        return stop
+
+    def profiled(self, fn: Callable) -> Callable:
+        """
+        Decorate an endpoint so it is profiled when its request is
+        Async endpoints are only stack-sampled: a cProfile on the event loop would also count
+        every other task, so their CPU profile comes from the threads they hand work to via traced
+        """
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                profile = _current_profile.get()
+                if profile is None:
+                    return await fn(*args, **kwargs)
+                stop = self._begin(profile, cpu=False)
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    stop()
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = _current_profile.get()
+            if profile is None:
+                return fn(*args, **kwargs)
+            stop = self._begin(profile, cpu=profile.full)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stop()
+        return wrapper
+
+    def traced(self, fn: Callable) -> Callable:
+        """
+        Decorate work handed to a thread pool so its stacks count toward the request's profile
+        Submit it through contextvars.copy_context().run so the profile is visible in the worker;
+        for a fully profiled request it is also CPU-profiled when no other cProfile is running
+        """
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = _current_profile.get()
+            if profile is None:
+                return fn(*args, **kwargs)
+            stop = self._begin(profile, cpu=profile.full)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stop()
+        return wrapper
+
+    def recent(self) -> List[Dict[str, Any]]:
+        """Summaries of the stored request profiles, newest first"""
+        with self._lock:
+            return [profile.summary() for profile in reversed(self._profiles)]
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        """Look up a stored request profile"""
+        with self._lock:
+            for profile in self._profiles:
+                if profile.id == profile_id:
+                    return profile
+        return None
+
+    def flamegraph(self) -> List[Dict[str, Any]]:
+        """Aggregated stacks from traffic sampling"""
+        with self.sampler._lock:
+            return [{"stack": stack, "wall_us": wall_us} for stack, wall_us in self.aggregate.most_common()]
+
+    def reset(self) -> None:
+        """Drop aggregated samples and stored profiles"""
+        with self.sampler._lock:
+            self.aggregate.clear()
+        with self._lock:
+            self._profiles.clear()
+        self.sampled_requests = 0
+
+def collapsed_text(stacks: List[Dict[str, Any]]) -> str:
+    """Format stacks as 'frame;frame;frame weight' lines for flamegraph.pl or speedscope"""
+    return "\n".join(f"{entry['stack']} {entry['wall_us']}" for entry in stacks)
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that starts and finishes request profiles
+    A request is fully profiled when it carries X-Profile: 1 or ?profile=1 and is_authorized
+    accepts its headers; the profile id comes back in the X-Profile-Id response header
+    """
+
+    def __init__(self, app, profiler: Profiler, is_authorized: Callable[[Dict[str, str]], bool]):
+        self.app = app
+        self.profiler = profiler
+        self.is_authorized = is_authorized
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        query_string = scope.get("query_string", b"")
+        flagged = headers.get("x-profile") == "1" or (
+            b"profile=" in query_string and parse_qs(query_string.decode("latin-1")).get("profile") == ["1"]
+        )
+        explicit = flagged and self.is_authorized(headers)
+        profile = self.profiler.start_request(scope["path"], explicit)
+        if profile is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start" and profile.full:
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            self.profiler.finish_request(profile)
+
+
+# Test function
+if __name__ == "__main__":
+    profiler = Profiler(interval_ms=1)
+
+    @profiler.profiled
+    def busy(n: int) -> int:
+        time.sleep(0.02)
+        return sum(i * i for i in range(n))
+
+    request_profile = profiler.start_request("/example", explicit=True)
+    busy(300000)
+    profiler.finish_request(request_profile)
+    result = profiler.get(request_profile.id).to_dict()
+    print(result["wall_ms"], result["cpu_ms"])
+    print(result["cpu_by_function"][:3])
+    print(result["wall_by_function"][:3])
@@ -0,0 +1,286 @@
+"""
+Search Index for LegisLight
+BM25-ranked full-text index over processed documents, simplifications and detected rights
+"""
+
+import hashlib
+import html
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    file_name TEXT,
+    file_type TEXT,
+    title TEXT,
+    indexed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_type ON documents (file_type, indexed_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries USING fts5(
+    doc_id UNINDEXED,
+    kind UNINDEXED,
+    heading,
+    body,
+    tokenize = 'porter unicode61'
+);
+CREATE TABLE IF NOT EXISTS entry_keys (
+    entry_rowid INTEGER PRIMARY KEY,
+    doc_id TEXT NOT NULL,
+    kind TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entry_keys_doc ON entry_keys (doc_id, kind);
+"""
+
+# Kinds of indexed entries
+ENTRY_KINDS = ("document", "section", "simplification", "right")
+
+# entry_keys maps each FTS row to its document and kind, since FTS5 cannot index
+# its UNINDEXED columns and deleting by them would scan the whole table
+
+# Headings count double when ranking; doc_id and kind are unindexed columns
+BM25_WEIGHTS = "0.0, 0.0, 2.0, 1.0"
+
+# Private-use characters SQLite wraps around matches; they are swapped for the real tags after escaping
+MATCH_START, MATCH_END = "\ue000", "\ue001"
+
+QUERY_TOKEN_RE = re.compile(r'"([^"]+)"|(\w+)')
+
+def mark_matches(text: Optional[str], open_tag: str, close_tag: str) -> Optional[str]:
+    """HTML-escape highlighted text from SQLite, then turn its match markers into tags"""
+    if text is None:
+        return None
+    return html.escape(text).replace(MATCH_START, open_tag).replace(MATCH_END, close_tag)
+
+def document_id(text: str) -> str:
+    """Stable id for a document, shared by its upload and its analysis"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+def to_match_query(query: str, match_all: bool = True) -> str:
+    """Turn free text into an FTS5 query; quoted phrases stay phrases, all other syntax is neutralised"""
+    terms = []
+    for phrase, word in QUERY_TOKEN_RE.findall(query):
+        words = re.findall(r"\w+", phrase) if phrase else [word]
+        if words:
+            terms.append('"' + " ".join(words) + '"')
+    return (" AND " if match_all else " OR ").join(terms)
+
+class SearchIndex:
+    """SQLite FTS5 index, safe to share between worker processes"""
+
+    def __init__(self, db_path: str = "data/index/search.db"):
+        """Open (or create) the index database"""
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # Searches get their own per-thread connections so they never wait on the indexing lock
+        self._readers = threading.local()
+        self._backfill_entry_keys()
+
+    def _reader(self) -> sqlite3.Connection:
+        """Read-only connection for the calling thread"""
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA query_only=ON")
+            self._readers.conn = conn
+        return conn
+
+    def _backfill_entry_keys(self) -> None:
+        """Map entries indexed before entry_keys existed"""
+        with self._lock, self._conn:
+            if self._conn.execute("SELECT 1 FROM entry_keys LIMIT 1").fetchone() is None:
+                self._conn.execute("INSERT INTO entry_keys (entry_rowid, doc_id, kind) SELECT rowid, doc_id, kind FROM entries")
+
+    def _replace_entries(self, doc_id: str, kinds: List[str], rows: List[tuple], document: Dict[str, Any]) -> None:
+        """Swap out one document's entries of the given kinds and upsert its metadata"""
+        with self._lock, self._conn:
+            existing = self._conn.execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            merged = dict(existing) if existing else {}
+            merged.update({key: value for key, value in document.items() if value})
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (doc_id, file_name, file_type, title, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (doc_id, merged.get("file_name"), merged.get("file_type"), merged.get("title"), datetime.now().isoformat()),
+            )
+            kind_params = ', '.join('?' for _ in kinds)
+            stale = [(row[0],) for row in self._conn.execute(
+                f"SELECT entry_rowid FROM entry_keys WHERE doc_id = ? AND kind IN ({kind_params})",
+                (doc_id, *kinds),
+            )]
+            self._conn.executemany("DELETE FROM entries WHERE rowid = ?", stale)
+            self._conn.executemany("DELETE FROM entry_keys WHERE entry_rowid = ?", stale)
+            for kind, heading, body in rows:
+                entry_rowid = self._conn.execute(
+                    "INSERT INTO entries (doc_id, kind, heading, body) VALUES (?, ?, ?, ?)",
+                    (doc_id, kind, heading, body),
+                ).lastrowid
+                self._conn.execute(
+                    "INSERT INTO entry_keys (entry_rowid, doc_id, kind) VALUES (?, ?, ?)",
+                    (entry_rowid, doc_id, kind),
+                )
+
+    def index_document(self, processed: Dict[str, Any]) -> str:
+        """Index the output of DocumentProcessor.process_document; returns the doc_id"""
+        doc_id = document_id(processed["text"])
+        self._replace_entries(
+            doc_id,
+            ["document"],
+            [("document", processed.get("file_name") or "", processed["text"])],
+            {"file_name": processed.get("file_name"), "file_type": processed.get("file_type")},
+        )
+        return doc_id
+
+    def index_analysis(
+        self,
+        text: str,
+        segmented: Dict[str, Any],
+        simplified_sections: Dict[str, Dict],
+        detected_rights: List[Dict],
+    ) -> str:
+        """Index sections, plain-language summaries and detected rights for a document; returns the doc_id"""
+        doc_id = document_id(text)
+        rows = []
+        for section in segmented.get("sections", []):
+            rows.append(("section", section.get("heading", ""), section.get("body", "")))
+        for heading, simplified in simplified_sections.items():
+            body = "\n".join(
+                [simplified.get("plain_summary", "")]
+                + simplified.get("key_points", [])
+                + simplified.get("ambiguous_terms", [])
+            )
+            rows.append(("simplification", heading, body))
+        for right in detected_rights:
+            body = "\n".join(filter(None, [right.get("plain_explanation"), right.get("location_in_doc")]))
+            rows.append(("right", right.get("right_name", ""), body))
+        self._replace_entries(doc_id, ["section", "simplification", "right"], rows, {"title": segmented.get("title")})
+        return doc_id
+
+    def search(
+        self,
+        query: str,
+        kinds: Optional[List[str]] = None,
+        file_type: Optional[str] = None,
+        doc_id: Optional[str] = None,
+        since: Optional[str] = None,
+        match_all: bool = True,
+        limit: int = 20,
+        offset: int = 0,
+        highlight: tuple = ("<mark>", "</mark>"),
+    ) -> Dict[str, Any]:
+        """
+        Rank entries matching the query with BM25
+        Returns hits with highlighted heading and a highlighted body snippet;
+        both are HTML-escaped, so only the highlight tags are markup
+        """
+        match = to_match_query(query, match_all)
+        if not match:
+            return {"results": [], "query": match}
+
+        kind_clause = f"kind IN ({', '.join('?' for _ in kinds)})" if kinds else None
+        document_clauses = []
+        document_params: List[Any] = []
+        if file_type:
+            document_clauses.append("file_type = ?")
+            document_params.append(file_type)
+        if since:
+            document_clauses.append("indexed_at >= ?")
+            document_params.append(since)
+
+        conn = self._reader()
+        if doc_id:
+            hits = self._rank_document(conn, match, doc_id, kinds, document_clauses, document_params)[offset:offset + limit]
+        else:
+            # Rank on the FTS table alone so FTS5 orders by its own rank before anything is joined
+            clauses = ["entries MATCH ?", f"rank MATCH 'bm25({BM25_WEIGHTS})'"]
+            params: List[Any] = [match]
+            if kind_clause:
+                clauses.append(kind_clause)
+                params.extend(kinds)
+            if document_clauses:
+                clauses.append(f"doc_id IN (SELECT doc_id FROM documents WHERE {' AND '.join(document_clauses)})")
+                params.extend(document_params)
+            hits = conn.execute(
+                f"SELECT rowid, rank FROM entries WHERE {' AND '.join(clauses)} ORDER BY rank LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+
+        # Highlighting is only worth doing for the page of hits being returned
+        open_tag, close_tag = highlight
+        results = []
+        for hit in hits:
+            row = conn.execute(
+                """
+                SELECT entries.doc_id, entries.kind, documents.file_name, documents.file_type, documents.title,
+                       highlight(entries, 2, ?, ?) AS heading,
+                       snippet(entries, 3, ?, ?, '...', 24) AS snippet
+                FROM entries JOIN documents ON documents.doc_id = entries.doc_id
+                WHERE entries MATCH ? AND entries.rowid = ?
+                """,
+                (MATCH_START, MATCH_END, MATCH_START, MATCH_END, match, hit["rowid"]),
+            ).fetchone()
+            if row is None:
+                continue
+            results.append({
+                **dict(row),
+                "heading": mark_matches(row["heading"], open_tag, close_tag),
+                "snippet": mark_matches(row["snippet"], open_tag, close_tag),
+                "score": round(-hit["rank"], 4)
+            })
+        return {"results": results, "query": match}
+
+    @staticmethod
+    def _rank_document(
+        conn: sqlite3.Connection,
+        match: str,
+        doc_id: str,
+        kinds: Optional[List[str]],
+        document_clauses: List[str],
+        document_params: List[Any],
+    ) -> List[sqlite3.Row]:
+        """
+        Rank one document's matching entries, best first
+        FTS5 cannot filter on its UNINDEXED doc_id, so the entries are found through entry_keys
+        and each is matched by rowid instead of filtering every hit in the index
+        """
+        if document_clauses and conn.execute(
+            f"SELECT 1 FROM documents WHERE doc_id = ? AND {' AND '.join(document_clauses)}",
+            (doc_id, *document_params),
+        ).fetchone() is None:
+            return []
+        key_sql = "SELECT entry_rowid FROM entry_keys WHERE doc_id = ?"
+        if kinds:
+            key_sql += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+        hits = []
+        for (entry_rowid,) in conn.execute(key_sql, (doc_id, *(kinds or []))).fetchall():
+            hit = conn.execute(
+                f"SELECT rowid, bm25(entries, {BM25_WEIGHTS}) AS rank FROM entries WHERE entries MATCH ? AND rowid = ?",
+                (match, entry_rowid),
+            ).fetchone()
+            if hit is not None:
+                hits.append(hit)
+        hits.sort(key=lambda hit: hit["rank"])
+        return hits
+
+# Test function
+if __name__ == "__main__":
+    index = SearchIndex("data/index/example.db")
+    text = "Section 1. The defendant has the right to counsel at every hearing."
+    index.index_document({"text": text, "file_name": "notice.txt", "file_type": "txt"})
+    index.index_analysis(
+        text,
+        {"title": "Example Notice", "sections": [{"heading": "Section 1", "body": text}]},
+        {"Section 1": {"plain_summary": "You can have a lawyer.", "key_points": ["Ask for a lawyer"]}},
+        [{"right_name": "Right to Counsel", "plain_explanation": "You can have a lawyer represent you."}],
+    )
+    for hit in index.search("lawyer")["results"]:
+        print(hit)
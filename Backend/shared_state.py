@@ -0,0 +1,111 @@
+"""
+Shared State Store for LegisLight
+Result cache and rate-limit budgets shared by every server worker process
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cache_expiry ON result_cache (expires_at);
+CREATE TABLE IF NOT EXISTS rate_budget (
+    key TEXT PRIMARY KEY,
+    window_start REAL NOT NULL,
+    used INTEGER NOT NULL
+);
+"""
+
+class SharedStore:
+    """SQLite WAL store that is safe to use from several processes at once"""
+
+    def __init__(self, db_path: str = "data/state/shared.db"):
+        """Open (or create) the shared database"""
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def cache_get(self, key: str) -> Optional[Any]:
+        """Return a cached value, or None if missing or expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM result_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def cache_set(self, key: str, value: Any, ttl: float = 3600) -> None:
+        """Store a JSON-serializable value for ttl seconds"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO result_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), now + ttl),
+            )
+            self._conn.execute("DELETE FROM result_cache WHERE expires_at <= ?", (now,))
+
+    def try_acquire(self, key: str, limit: int, window: float = 60.0) -> float:
+        """
+        Take one unit from a fixed-window budget shared across processes
+        Returns 0 on success, otherwise the seconds until the window resets
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT window_start, used FROM rate_budget WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or now - row[0] >= window:
+                    window_start, used = now, 0
+                else:
+                    window_start, used = row
+
+                if used >= limit:
+                    self._conn.execute("COMMIT")
+                    return window_start + window - now
+
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_budget (key, window_start, used) VALUES (?, ?, ?)",
+                    (key, window_start, used + 1),
+                )
+                self._conn.execute("COMMIT")
+                return 0.0
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def acquire(self, key: str, limit: int, window: float = 60.0, max_wait: float = 30.0) -> None:
+        """
+        Block until a unit of the shared budget is available
+        Raises TimeoutError instead of waiting past max_wait seconds
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire(key, limit, window)
+            if wait <= 0:
+                return
+            if wait > deadline - time.monotonic():
+                raise TimeoutError(f"Rate budget '{key}' is exhausted for another {wait:.1f}s (max wait {max_wait:g}s)")
+            time.sleep(min(wait, 1.0))
+
+
+# Test function
+if __name__ == "__main__":
+    store = SharedStore()
+    store.cache_set("example", {"value": 1}, ttl=5)
+    print("Cached:", store.cache_get("example"))
+    for i in range(3):
+        print(f"Acquire {i}: wait {store.try_acquire('example-budget', limit=2):.1f}s")
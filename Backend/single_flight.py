@@ -0,0 +1,118 @@
+"""
+Single-Flight Request Coalescing for LegisLight
+Concurrent calls with the same key share one execution and its result
+"""
+
+import copy
+import functools
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different copies of a document share a key"""
+    return " ".join(text.split())
+
+def text_key(*parts: str) -> str:
+    """Hash normalized key parts into a compact key"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(normalize_text(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class CoalesceTimeout(TimeoutError):
+    """A follower gave up waiting on the leader of an identical call"""
+
+class _Call:
+    """One in-flight execution that followers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """Thread-safe single-flight group; the first caller for a key runs it, later callers wait"""
+
+    def __init__(self, timeout: Optional[float] = None):
+        """timeout bounds how long a follower waits for the leader's result"""
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn once per key at a time
+        Followers receive a copy of the leader's result, or the leader's exception
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        if not call.done.wait(self.timeout):
+            raise CoalesceTimeout(f"Timed out after {self.timeout}s waiting for an identical in-flight request")
+        if call.error is not None:
+            raise call.error
+        # Each caller gets its own copy so one cannot mutate another's result
+        return copy.deepcopy(call.result)
+
+    def stats(self) -> Dict[str, int]:
+        """Counts of executed and shared calls since startup"""
+        with self._lock:
+            return {"executed": self.executed, "shared": self.shared, "in_flight": len(self._calls)}
+
+def coalesce(key_fn: Callable[..., Hashable]):
+    """
+    Decorate a method so identical concurrent calls share one execution
+    key_fn receives the method's arguments (without self); the instance must have a single_flight attribute.
+    A follower that times out waiting makes the call itself instead of raising
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (method.__name__, key_fn(*args, **kwargs))
+            try:
+                return self.single_flight.do(key, lambda: method(self, *args, **kwargs))
+            except CoalesceTimeout as e:
+                # The leader is stuck; make the call independently so the method's own error handling applies
+                print(f"{e}; calling {method.__name__} directly")
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Test function
+if __name__ == "__main__":
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    group = SingleFlight(timeout=5)
+
+    def slow_call():
+        time.sleep(0.2)
+        return {"value": 42}
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        results = list(pool.map(lambda _: group.do("same", slow_call), range(10)))
+    print(results[0], group.stats())
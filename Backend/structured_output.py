@@ -0,0 +1,286 @@
+"""
+Structured Output Helpers for LegisLight
+Tool schemas for Claude's structured responses, a small schema validator,
+and an incremental JSON parser that surfaces completed list items while a reply streams
+"""
+
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+SEGMENT_TOOL = {
+    "name": "record_segments",
+    "description": "Record the document title and its logical sections in reading order.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string"},
+            "sections": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "heading": {"type": "string"},
+                        "body": {"type": "string"}
+                    },
+                    "required": ["heading", "body"]
+                }
+            }
+        },
+        "required": ["title", "sections"]
+    },
+    "stream_key": "sections"
+}
+
+SIMPLIFY_TOOL = {
+    "name": "record_simplification",
+    "description": "Record the plain-language version of a legal passage.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "plain_summary": {"type": "string"},
+            "key_points": {"type": "array", "items": {"type": "string"}},
+            "ambiguous_terms": {"type": "array", "items": {"type": "string"}},
+            "readability_note": {"type": "string"}
+        },
+        "required": ["plain_summary", "key_points", "ambiguous_terms", "readability_note"]
+    },
+    # A truncated reply is still usable as long as these fields arrived whole
+    "essential": ["plain_summary"]
+}
+
+RIGHTS_TOOL = {
+    "name": "record_rights",
+    "description": "Record every citizen or defendant right found in the document.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "rights": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "right_name": {"type": "string"},
+                        "plain_explanation": {"type": "string"},
+                        "location_in_doc": {"type": "string"},
+                        "disclaimer": {"type": "string"}
+                    },
+                    "required": ["right_name", "plain_explanation", "location_in_doc", "disclaimer"]
+                }
+            }
+        },
+        "required": ["rights"]
+    },
+    "stream_key": "rights"
+}
+
+BATCH_SIMPLIFY_TOOL = {
+    "name": "record_simplifications",
+    "description": "Record the plain-language version of each numbered legal passage.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        **SIMPLIFY_TOOL["input_schema"]["properties"]
+                    },
+                    "required": ["id", *SIMPLIFY_TOOL["input_schema"]["required"]]
+                }
+            }
+        },
+        "required": ["results"]
+    },
+    "stream_key": "results"
+}
+
+BATCH_TRANSLATE_TOOL = {
+    "name": "record_translations",
+    "description": "Record the translation of each numbered passage.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        "translation": {"type": "string"}
+                    },
+                    "required": ["id", "translation"]
+                }
+            }
+        },
+        "required": ["results"]
+    },
+    "stream_key": "results"
+}
+
+JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+}
+
+def tool_definition(tool: Dict) -> Dict:
+    """Return the subset of a tool spec that the Messages API accepts"""
+    return {key: tool[key] for key in ("name", "description", "input_schema")}
+
+def validate(value: Any, schema: Dict, path: str = "$") -> None:
+    """Check a value against the subset of JSON Schema used by the tools above; raise ValueError on mismatch"""
+    expected = schema.get("type")
+    if expected and not isinstance(value, JSON_TYPES[expected]):
+        raise ValueError(f"{path}: expected {expected}, got {type(value).__name__}")
+    if expected == "object":
+        for key in schema.get("required", []):
+            if key not in value:
+                raise ValueError(f"{path}: missing required field '{key}'")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in value:
+                validate(value[key], sub_schema, f"{path}.{key}")
+    elif expected == "array" and "items" in schema:
+        for i, item in enumerate(value):
+            validate(item, schema["items"], f"{path}[{i}]")
+
+def fill_missing(value: Dict, schema: Dict, keep_required: List[str]) -> Dict:
+    """Give empty defaults to fields a truncated reply never reached, except those in keep_required"""
+    defaults = {"string": "", "array": [], "object": {}}
+    filled = dict(value)
+    for key, sub_schema in schema.get("properties", {}).items():
+        if key not in filled and key not in keep_required and sub_schema.get("type") in defaults:
+            filled[key] = type(defaults[sub_schema["type"]])()
+    return filled
+
+
+class IncrementalJSONParser:
+    """
+    Parses a JSON object as it arrives in chunks
+    Completed objects inside the top-level array named by watch_key are handed to on_item
+    as soon as their closing brace arrives, and repair() turns a truncated document
+    into the largest valid prefix
+    """
+
+    def __init__(self, watch_key: Optional[str] = None, on_item: Optional[Callable[[Dict], None]] = None):
+        """Set up parser state"""
+        self.watch_key = watch_key
+        self.on_item = on_item
+        self.items: List[Dict] = []
+        self.buffer = ""
+        self._pos = 0
+        self._stack: List[Dict] = []
+        self._in_string = False
+        self._escape = False
+        self._string_is_key = False
+        self._string_start = 0
+        self._in_primitive = False
+        self._checkpoint = (0, "")
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """Consume the next chunk and return any list items it completed"""
+        self.buffer += chunk
+        completed = []
+        buffer = self.buffer
+        for pos in range(self._pos, len(buffer)):
+            char = buffer[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._string_is_key:
+                        self._stack[-1]["key"] = json.loads(buffer[self._string_start:pos + 1])
+                    else:
+                        self._mark(pos + 1)
+                continue
+
+            if char in " \t\r\n":
+                self._end_primitive(pos)
+            elif char == '"':
+                top = self._stack[-1] if self._stack else None
+                self._string_is_key = bool(top and top["type"] == "object" and top["expect_key"])
+                self._string_start = pos
+                self._in_string = True
+            elif char in "{[":
+                parent = self._stack[-1] if self._stack else None
+                frame = {"type": "object" if char == "{" else "array", "expect_key": char == "{", "key": None,
+                         "watched": False, "start": None}
+                if char == "[" and self.watch_key and len(self._stack) == 1 and parent["key"] == self.watch_key:
+                    frame["watched"] = True
+                if char == "{" and parent and parent["watched"]:
+                    frame["start"] = pos
+                self._stack.append(frame)
+                self._mark(pos + 1)
+            elif char in "}]":
+                self._end_primitive(pos)
+                if not self._stack:
+                    raise ValueError(f"Unbalanced '{char}' at position {pos}")
+                frame = self._stack.pop()
+                self._mark(pos + 1)
+                if frame["start"] is not None:
+                    item = json.loads(buffer[frame["start"]:pos + 1])
+                    self.items.append(item)
+                    completed.append(item)
+                    if self.on_item:
+                        self.on_item(item)
+            elif char == ",":
+                self._end_primitive(pos)
+                if self._stack and self._stack[-1]["type"] == "object":
+                    self._stack[-1]["expect_key"] = True
+            elif char == ":":
+                if self._stack and self._stack[-1]["type"] == "object":
+                    self._stack[-1]["expect_key"] = False
+            else:
+                self._in_primitive = True
+        self._pos = len(buffer)
+        return completed
+
+    def _end_primitive(self, pos: int) -> None:
+        """Close a number or literal that ended just before pos"""
+        if self._in_primitive:
+            self._in_primitive = False
+            self._mark(pos)
+
+    def _mark(self, pos: int) -> None:
+        """Remember that buffer[:pos] plus the open brackets' closers is valid JSON"""
+        closers = "".join("}" if frame["type"] == "object" else "]" for frame in reversed(self._stack))
+        self._checkpoint = (pos, closers)
+
+    def value(self) -> Any:
+        """Parse the complete document"""
+        return json.loads(self.buffer)
+
+    def repair(self) -> Any:
+        """Parse the longest valid prefix of a truncated document, closing any open brackets"""
+        pos, closers = self._checkpoint
+        prefix = self.buffer[:pos].rstrip().rstrip(",")
+        if not prefix:
+            raise ValueError("Nothing to repair: no complete JSON value was received")
+        return json.loads(prefix + closers)
+
+    def complete_fields(self) -> Dict:
+        """Repair a truncated object, leaving out the top-level field that was still open when it was cut off"""
+        value = self.repair()
+        _, closers = self._checkpoint
+        if isinstance(value, dict) and value and len(closers) > 1:
+            value.pop(list(value)[-1])
+        return value
+
+
+# Test function
+if __name__ == "__main__":
+    stream = [
+        '{"title": "Example Act", "sec', 'tions": [{"heading": "Short Title", "bo',
+        'dy": "This Act may be cited as the Example Act."}, {"heading": "Defin',
+    ]
+    parser = IncrementalJSONParser(watch_key="sections", on_item=lambda item: print("Section ready:", item))
+    for chunk in stream:
+        parser.feed(chunk)
+    print("Repaired:", parser.repair())